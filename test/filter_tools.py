@@ -55,6 +55,15 @@ class FilterFunctionTests(TestCase):
         self.assertFalse(combo_func(10))
         self.assertTrue(combo_func(12))
 
+    def test_apply_falls_back_to_calling_function_on_rows(self):
+        """Tests that a FilterFunction without a vectorized form can still be
+        applied to a column store by calling the function on each row"""
+        filter_func = filter_tools.FilterFunction(lambda val: val >= 5)
+        columns = {None: [3, 5, 7, 10, 1]}
+
+        self.assertEqual(filter_func.apply(columns), [1, 2, 3])
+        self.assertEqual(filter_func.apply(columns, [0, 3, 4]), [3])
+
 
 # noinspection SpellCheckingInspection
 class LogFilterTests(TestCase):
@@ -281,6 +290,199 @@ class LogFilterTests(TestCase):
         self.assertTrue(filter_function(in_set_1))
         self.assertFalse(filter_function(out_of_both_sets))
 
+    def test_attribute_that_is_not_an_identifier(self):
+        """Tests that LogFilter instances for attribute names that can't be
+        written as "object.attr" still compare the right attribute, including
+        ones the compiler would normalize into a different name"""
+        for attr in ('not-an-identifier', 'class', '\ufb01le'):
+            attr_filter = filter_tools.LogFilter(attr)
+            equal_object = MagicMock(**{attr: 5})
+            unequal_object = MagicMock(**{attr: 7})
+
+            filter_function = attr_filter == 5
+
+            self.assertTrue(filter_function(equal_object))
+            self.assertFalse(filter_function(unequal_object))
+
+    def test_repeated_comparisons_return_same_function(self):
+        """Tests that asking for the same comparison twice returns the same
+        function, and that unhashable values still produce a working one"""
+        self.assertIs(filter_tools.LogFilter('attr') == 5,
+                      filter_tools.LogFilter('attr') == 5)
+        self.assertIsNot(filter_tools.LogFilter('attr') == 5,
+                         filter_tools.LogFilter('attr') == 5.0)
+        self.assertIsNot(filter_tools.LogFilter('attr') == 5,
+                         filter_tools.LogFilter('other') == 5)
+
+        filter_function = filter_tools.LogFilter('attr') == [1, 2]
+
+        self.assertTrue(filter_function(MagicMock(attr=[1, 2])))
+        self.assertFalse(filter_function(MagicMock(attr=[1])))
+
+    def test_filter_without_attribute_compares_objects(self):
+        """Tests that a LogFilter with no attribute compares the provided
+        objects themselves, using the same operator meanings as any other
+        LogFilter"""
+        value_filter = filter_tools.LogFilter(None)
+
+        self.assertTrue((value_filter == 7)(7))
+        self.assertFalse((value_filter != 7)(7))
+        self.assertTrue((value_filter < 7)(10))
+        self.assertFalse((value_filter < 7)(5))
+        self.assertTrue((value_filter > 7)(5))
+        self.assertTrue((value_filter <= 7)(7))
+        self.assertFalse((value_filter <= 7)(5))
+        self.assertTrue((value_filter >= 7)(7))
+        self.assertFalse((value_filter >= 7)(10))
+        self.assertEqual((value_filter > 7).apply({None: [5, 10, 3]}), [0, 2])
+
+    def test_cheaper_filter_is_evaluated_first(self):
+        """Tests that combining a regex search with a comparison evaluates
+        the comparison first no matter which side of the operator it is on"""
+        str_filter = filter_tools.LogFilter('attr')
+        # a regex search on None raises a TypeError
+        none_object = MagicMock(attr=None)
+
+        and_function = (str_filter % r'word') & (str_filter != None)
+        or_function = (str_filter % r'word') | (str_filter == None)
+
+        self.assertFalse(and_function(none_object))
+        self.assertTrue(or_function(none_object))
+
+    def test_other_functions_are_evaluated_in_written_order(self):
+        """Tests that a function that isn't a LogFilter comparison only
+        sees the objects a regex search before it kept, even though the
+        search costs more"""
+        str_filter = filter_tools.LogFilter('attr')
+        objects = [MagicMock(attr='20.1.2.3'), MagicMock(attr='::1')]
+
+        and_function = (str_filter % r'^\d+\.\d+\.\d+\.\d+$') & \
+            (lambda obj: int(obj.attr.split('.')[0]) < 128)
+        columns = {None: objects, 'attr': [obj.attr for obj in objects]}
+
+        self.assertEqual([and_function(obj) for obj in objects],
+                         [True, False])
+        self.assertEqual(and_function.apply(columns), [0])
+
+    def test_leaves_record_comparison_applied_to_object(self):
+        """Tests that the ordering operators record the comparison that is
+        applied to the object's value, which is the reverse of the operator
+        used on the filter"""
+        int_filter = filter_tools.LogFilter('attr')
+
+        self.assertEqual((int_filter < 7).leaf, ('attr', '>', 7))
+        self.assertEqual((int_filter > 7).leaf, ('attr', '<', 7))
+        self.assertEqual((int_filter <= 7).leaf, ('attr', '>=', 7))
+        self.assertEqual((int_filter >= 7).leaf, ('attr', '<=', 7))
+        self.assertEqual((int_filter == 7).leaf, ('attr', '==', 7))
+        self.assertEqual((int_filter != 7).leaf, ('attr', '!=', 7))
+
+    def test_equality_checks_on_same_attribute_are_merged(self):
+        """Tests that "|" between "==" comparisons on the same attribute
+        produces a single membership test, and "&" between "!=" comparisons
+        produces a single non-membership test, with the same results"""
+        int_filter = filter_tools.LogFilter('attr')
+        other_filter = filter_tools.LogFilter('other')
+        objects = [MagicMock(attr=attr, other=0) for attr in (22, 80, 443, 25)]
+
+        any_of = (int_filter == 22) | (int_filter == 80) | (int_filter == 443)
+        none_of = (int_filter != 22) & (int_filter != 80)
+        mixed = (int_filter == 22) | (other_filter == 80)
+
+        self.assertEqual(any_of.leaf, ('attr', 'in', {22, 80, 443}))
+        self.assertEqual([any_of(obj) for obj in objects],
+                         [True, True, True, False])
+        self.assertEqual(none_of.leaf, ('attr', 'not in', {22, 80}))
+        self.assertEqual([none_of(obj) for obj in objects],
+                         [False, False, True, True])
+        self.assertIsNone(mixed.leaf)
+        self.assertEqual([mixed(obj) for obj in objects],
+                         [True, False, False, False])
+
+    def test_merged_checks_compare_unhashable_values(self):
+        """Tests that merged equality checks give the same result as the
+        comparisons they replaced for values that can't be hashed"""
+        list_filter = filter_tools.LogFilter('attr')
+        rows = [MagicMock(attr=attr) for attr in ([1], 1, [2], 3)]
+        columns = {None: rows, 'attr': [row.attr for row in rows]}
+
+        any_of = (list_filter == 1) | (list_filter == 2)
+        none_of = (list_filter != 1) & (list_filter != 2)
+
+        self.assertEqual([any_of(row) for row in rows],
+                         [False, True, False, False])
+        self.assertEqual([none_of(row) for row in rows],
+                         [True, False, True, True])
+        self.assertEqual(any_of.apply(columns), [1])
+        self.assertEqual(none_of.apply(columns), [0, 2, 3])
+
+    def test_only_log_filter_comparisons_are_pure(self):
+        """Tests that functions made only of comparisons against hashable
+        values are marked pure, and that anything involving another function
+        or a value that could be changed later is not"""
+        int_filter = filter_tools.LogFilter('attr')
+        str_filter = filter_tools.LogFilter('other')
+
+        pure = [int_filter == 5,
+                str_filter % r'word',
+                (int_filter > 5) & (str_filter != 'a'),
+                (int_filter == 5) | (int_filter == 6),
+                (int_filter < 5) - (str_filter == 'a')]
+        impure = [filter_tools.FilterFunction(lambda value: True),
+                  int_filter == [5],
+                  (int_filter > 5) & (lambda value: True),
+                  (int_filter == 5) | (int_filter == [6])]
+
+        self.assertTrue(all(function.pure for function in pure))
+        self.assertFalse(any(function.pure for function in impure))
+        self.assertEqual(((int_filter > 5) & (str_filter % r'word')).key,
+                         ((int_filter > 5) & (str_filter % r'word')).key)
+
+    def test_apply_matches_calling_function_on_each_row(self):
+        """Tests that applying a log filter's function to a column store
+        selects the same rows as calling the function on every object"""
+        filter0 = filter_tools.LogFilter('attr0')
+        filter1 = filter_tools.LogFilter('attr1')
+        rows = [MagicMock(attr0=attr0, attr1=attr1)
+                for attr0 in (5, 10, 15) for attr1 in ('a_b', 'b', 'c_a')]
+        columns = {None: rows,
+                   'attr0': [row.attr0 for row in rows],
+                   'attr1': [row.attr1 for row in rows]}
+
+        filter_functions = [
+            filter0 == 10,
+            filter0 < 7,
+            filter1 % r'a',
+            (filter0 >= 10) & (filter1 != 'b'),
+            (filter0 == 5) | (filter1 % r'^c'),
+            (filter0 > 12) + (filter1 == 'b'),
+            (filter0 <= 10) - (filter1 % r'_'),
+            (filter0 == 15) & (lambda row: row.attr1 == 'c_a'),
+            (filter0 == 5) | (filter0 == 15),
+            (filter1 != 'b') & (filter1 != 'a_b'),
+        ]
+        for filter_function in filter_functions:
+            expected = [index for index, row in enumerate(rows)
+                        if filter_function(row)]
+            self.assertEqual(filter_function.apply(columns), expected)
+
+    def test_apply_only_checks_rows_kept_by_left_side(self):
+        """Tests that applying a combined function to a column store does not
+        evaluate the right side on rows the left side already decided, the
+        same way "and"/"or" short-circuit when called on a single object"""
+        filter0 = filter_tools.LogFilter('attr0')
+        filter1 = filter_tools.LogFilter('attr1')
+        # a regex search on None raises a TypeError
+        columns = {None: [None, None, None],
+                   'attr0': [None, 'value', None],
+                   'attr1': ['value', None, 'other']}
+
+        and_function = (filter0 != None) & (filter0 % r'val')
+        or_function = (filter1 == None) | (filter1 % r'val')
+
+        self.assertEqual(and_function.apply(columns), [1])
+        self.assertEqual(or_function.apply(columns), [0, 1])
+
 
 class PresetFiltersTests(TestCase):
     def test_all_filters_are_correct_type(self):
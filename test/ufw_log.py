@@ -0,0 +1,392 @@
+import copy
+import gzip
+import os
+import pickle
+import tempfile
+from datetime import datetime
+from unittest import TestCase, main
+from ufw import ufw
+from ufw import DPT, EVENT, SRC
+
+BLOCK_LINE = ('Sep 21 10:15:01 myhost kernel: [81234.567890] [UFW BLOCK] '
+              'IN=eth0 OUT= MAC=aa:bb:cc:dd:ee:ff:00:11:22:33:44:55:08:00 '
+              'SRC=20.20.20.20 DST=192.168.1.10 LEN=60 TOS=0x00 PREC=0x00 '
+              'TTL=52 ID=27519 DF PROTO=TCP SPT=43254 DPT=25565 WINDOW=64240 '
+              'RES=0x00 ACK PSH URGP=0 ')
+ALLOW_LINE = ('Sep  3 09:00:59 myhost kernel: [   12.000001] [UFW ALLOW] '
+              'IN=eth0 OUT= MAC=aa:bb:cc:dd:ee:ff:00:11:22:33:44:55:08:00 '
+              'SRC=10.0.0.5 DST=192.168.1.10 LEN=40 TOS=0x00 PREC=0x00 '
+              'TTL=64 ID=0 DF PROTO=TCP SPT=51000 DPT=22 WINDOW=1024 '
+              'RES=0x00 SYN URGP=0 ')
+LIMIT_LINE = ('Sep 30 23:59:59 myhost kernel: [99999.999999] '
+              '[UFW LIMIT BLOCK] IN=eth0 OUT= '
+              'MAC=aa:bb:cc:dd:ee:ff:00:11:22:33:44:55:08:00 SRC=20.20.20.20 '
+              'DST=192.168.1.10 LEN=40 TOS=0x00 PREC=0x00 TTL=64 ID=1 DF '
+              'PROTO=TCP SPT=51001 DPT=22 WINDOW=1024 RES=0x00 SYN URGP=0 ')
+
+ICMP_LINE = ('Sep 21 11:00:00 myhost kernel: [81300.000001] [UFW BLOCK] '
+             'IN=eth0 OUT= MAC=aa:bb:cc:dd:ee:ff:00:11:22:33:44:55:08:00 '
+             'SRC=30.30.30.30 DST=192.168.1.10 LEN=88 TOS=0x00 PREC=0x00 '
+             'TTL=54 ID=4242 PROTO=ICMP TYPE=3 CODE=3 [SRC=192.168.1.10 '
+             'DST=30.30.30.30 LEN=60 TOS=0x00 PREC=0x00 TTL=63 ID=0 DF '
+             'PROTO=UDP SPT=53 DPT=5353 LEN=40 ] ')
+
+PING_LINE = ('Sep 21 12:00:00 myhost kernel: [81400.000001] [UFW BLOCK] '
+             'IN=eth0 OUT= MAC=aa:bb:cc:dd:ee:ff:00:11:22:33:44:55:08:00 '
+             'SRC=40.40.40.40 DST=192.168.1.10 LEN=84 TOS=0x00 PREC=0x00 '
+             'TTL=57 ID=7 DF PROTO=ICMP TYPE=8 CODE=0 ID=7 SEQ=1 ')
+
+class TaggedEntry(ufw.UFWLogEntry):
+    __slots__ = ()
+
+
+class UFWLogEntryTests(TestCase):
+    """
+    Tests for turning a single line of a ufw log into a UFWLogEntry
+    """
+    def test_parses_all_fields_of_a_line(self):
+        """Tests that every part of a line ends up on the matching
+        attribute of the entry"""
+        entry = ufw.UFWLogEntry.from_str(BLOCK_LINE)
+
+        self.assertEqual(entry.event_datetime,
+                         datetime(1900, 9, 21, 10, 15, 1))
+        self.assertEqual(entry.hostname, 'myhost kernel:')
+        self.assertEqual(entry.uptime, 81234.567890)
+        self.assertEqual(entry.event, 'BLOCK')
+        self.assertEqual(entry.IN, 'eth0')
+        self.assertIsNone(entry.OUT)
+        self.assertEqual(entry.MAC,
+                         'aa:bb:cc:dd:ee:ff:00:11:22:33:44:55:08:00')
+        self.assertEqual(entry.SRC, '20.20.20.20')
+        self.assertEqual(entry.DST, '192.168.1.10')
+        self.assertEqual(entry.PROTO, 'TCP')
+        self.assertEqual(entry.SPT, 43254)
+        self.assertEqual(entry.DPT, 25565)
+        self.assertEqual(entry.LEN, 60)
+        self.assertEqual(entry.TTL, 52)
+        self.assertEqual(entry.ID, 27519)
+        self.assertEqual(entry.WINDOW, 64240)
+        self.assertEqual(entry.TOS, '0x00')
+        self.assertTrue(entry.ACK)
+        self.assertTrue(entry.PSH)
+
+    def test_parses_padded_day_and_uptime(self):
+        """Tests that the spaces syslog puts before single digit days and
+        ufw puts before short uptimes don't break parsing"""
+        entry = ufw.UFWLogEntry.from_str(ALLOW_LINE)
+
+        self.assertEqual(entry.event_datetime.day, 3)
+        self.assertEqual(entry.uptime, 12.000001)
+        self.assertEqual(entry.event, 'ALLOW')
+        self.assertFalse(entry.ACK)
+        self.assertFalse(entry.PSH)
+
+    def test_parses_event_with_more_than_one_word(self):
+        """Tests that events like "LIMIT BLOCK" are kept whole"""
+        entry = ufw.UFWLogEntry.from_str(LIMIT_LINE)
+
+        self.assertEqual(entry.event, 'LIMIT BLOCK')
+
+    def test_subclasses_are_pickled_and_copied_as_themselves(self):
+        """Tests that pickling or copying an entry of a subclass gives back
+        an entry of that subclass"""
+        entry = TaggedEntry(*ufw._INIT_ARGS(ufw.UFWLogEntry.from_str(
+            BLOCK_LINE)))
+
+        self.assertIs(type(pickle.loads(pickle.dumps(entry))), TaggedEntry)
+        self.assertIs(type(copy.copy(entry)), TaggedEntry)
+
+    def test_repeated_text_is_shared_between_entries(self):
+        """Tests that text fields repeated across lines are held as one
+        string by every entry that has them"""
+        block = ufw.UFWLogEntry.from_str(BLOCK_LINE)
+        limit = ufw.UFWLogEntry.from_str(LIMIT_LINE)
+
+        for name in ('hostname', 'IN', 'MAC', 'SRC', 'DST', 'PROTO'):
+            self.assertIs(getattr(block, name), getattr(limit, name))
+
+    def test_keeps_fields_of_icmp_error_over_quoted_packet(self):
+        """Tests that the packet an ICMP error quotes in brackets doesn't
+        replace any of the fields of the entry"""
+        entry = ufw.UFWLogEntry.from_str(ICMP_LINE)
+
+        self.assertEqual(entry.SRC, '30.30.30.30')
+        self.assertEqual(entry.DST, '192.168.1.10')
+        self.assertEqual(entry.PROTO, 'ICMP')
+        self.assertEqual(entry.LEN, 88)
+        self.assertEqual(entry.TTL, 54)
+        self.assertEqual(entry.ID, 4242)
+        self.assertIsNone(entry.SPT)
+        self.assertIsNone(entry.DPT)
+
+    def test_rejects_lines_that_are_not_ufw_entries(self):
+        """Tests that lines which aren't ufw log entries raise a ValueError"""
+        with self.assertRaises(ValueError):
+            ufw.UFWLogEntry.from_str('Sep 21 10:15:01 myhost systemd[1]: hi')
+
+    def test_pickled_entries_keep_every_attribute(self):
+        """Tests that an entry comes back from pickling with the same value
+        for every attribute"""
+        entry = ufw.UFWLogEntry.from_str(BLOCK_LINE)
+
+        restored = pickle.loads(pickle.dumps(entry))
+
+        for name in ufw.UFWLogEntry.__slots__:
+            self.assertEqual(getattr(restored, name), getattr(entry, name))
+
+
+class UFWLogFileTests(TestCase):
+    """
+    Tests for reading a ufw log file and searching the entries in it
+    """
+    def setUp(self):
+        handle, self.filename = tempfile.mkstemp()
+        with os.fdopen(handle, 'w') as writer:
+            writer.write('\n'.join([BLOCK_LINE, ALLOW_LINE, LIMIT_LINE]))
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_reads_every_line_with_year_of_file(self):
+        """Tests that every line in the file becomes an entry, and that the
+        entries are given the year the file was created in"""
+        log = ufw.UFWLogFile(self.filename)
+        year = datetime.fromtimestamp(os.path.getctime(self.filename)).year
+
+        self.assertEqual([entry.event for entry in log],
+                         ['BLOCK', 'ALLOW', 'LIMIT BLOCK'])
+        self.assertTrue(all(entry.event_datetime.year == year
+                            for entry in log))
+
+    def test_filter_functions_select_matching_entries(self):
+        """Tests that indexing with filter functions, lists of functions and
+        plain callables returns the matching entries in file order"""
+        log = ufw.UFWLogFile(self.filename)
+        block, allow, limit = log.log_events
+
+        self.assertEqual(log[DPT == 22], [allow, limit])
+        self.assertEqual(log[(DPT == 22) & (SRC == '20.20.20.20')], [limit])
+        self.assertEqual(log[[[EVENT % 'BLOCK', DPT < 100]]], [block])
+        self.assertEqual(log[lambda entry: entry.ACK], [block])
+        self.assertEqual(log.search([(EVENT == 'ALLOW') | (DPT == 25565)]),
+                         [block, allow])
+        self.assertEqual(log.search(), [block, allow, limit])
+
+    def test_search_runs_other_functions_after_those_before_them(self):
+        """Tests that a function that isn't a LogFilter comparison only sees
+        the entries kept by the functions listed before it"""
+        log = ufw.UFWLogFile(self.filename)
+        block, allow, limit = log.log_events
+        seen = []
+
+        def from_low_port(entry):
+            seen.append(entry)
+            return entry.SPT < 51001
+
+        self.assertEqual(log.search([SRC % r'^20\.', from_low_port]),
+                         [block])
+        self.assertEqual(seen, [block, limit])
+
+    def test_search_by_value_and_range(self):
+        """Tests that search_eq returns the entries where a field equals a
+        value and search_between the ones where it's within a range"""
+        log = ufw.UFWLogFile(self.filename)
+        block, allow, limit = log.log_events
+
+        self.assertEqual(log.search_eq('SRC', '20.20.20.20'), [block, limit])
+        self.assertEqual(log.search_eq('SRC', '30.30.30.30'), [])
+        self.assertEqual(log.search_eq('SRC', ['20.20.20.20']), [])
+        self.assertEqual(list(log.columns.lookup('SRC', '20.20.20.20')),
+                         [0, 2])
+        self.assertEqual(list(log.columns.lookup('SRC', '10.0.0.5')), [1])
+        self.assertEqual(log.columns.index('SRC')['10.0.0.5'], 1)
+        self.assertEqual(log.search_eq('event', 'LIMIT BLOCK'), [limit])
+        self.assertEqual(log.search_eq('DPT', 22), [allow, limit])
+        self.assertEqual(log.search_eq('ID', 0), [allow])
+        # fields with a value for nearly every row are searched, not indexed
+        self.assertIn((('ID', '==', 0),), log.columns.selections)
+        self.assertEqual(log.search_between('SPT', 51000, 51001),
+                         [allow, limit])
+        self.assertEqual(log.search_between('uptime', 0, 81234.56789),
+                         [block, allow])
+
+    def test_repeated_search_reuses_results_until_entries_change(self):
+        """Tests that searching twice with the same filter functions only
+        filters once, and that the results are found again once the entries
+        have changed"""
+        log = ufw.UFWLogFile(self.filename)
+        block, allow, limit = log.log_events
+        search_fns = [DPT == 22]
+
+        first = log.search(search_fns)
+        first.clear()
+        self.assertEqual(log.search(search_fns), [allow, limit])
+        self.assertEqual(len(log.columns.selections), 1)
+
+        log.log_events.append(ufw.UFWLogEntry.from_str(ALLOW_LINE))
+        self.assertEqual(len(log.search(search_fns)), 3)
+
+    def test_searches_with_other_callables_are_not_reused(self):
+        """Tests that a search combining a LogFilter comparison with some
+        other function is run again, since that function may now give a
+        different answer"""
+        log = ufw.UFWLogFile(self.filename)
+        block, allow, limit = log.log_events
+        watched = {'10.0.0.5'}
+        search_fns = [(DPT == 22) & (lambda entry: entry.SRC in watched)]
+
+        self.assertEqual(log.search(search_fns), [allow])
+        watched.add('20.20.20.20')
+        self.assertEqual(log.search(search_fns), [allow, limit])
+        self.assertEqual(log.columns.selections, {})
+
+    def test_remembered_searches_are_limited_by_rows(self):
+        """Tests that the oldest searches are dropped to keep the rows held
+        for earlier searches within SEARCH_CACHE_ROWS"""
+        self.addCleanup(setattr, ufw, 'SEARCH_CACHE_ROWS',
+                        ufw.SEARCH_CACHE_ROWS)
+        ufw.SEARCH_CACHE_ROWS = 2
+        log = ufw.UFWLogFile(self.filename)
+
+        log.search([DPT == 22])
+        log.search([SRC == '20.20.20.20'])
+        log.search([DPT < 0])
+
+        self.assertEqual(list(log.columns.selections),
+                         [(('SRC', '==', '20.20.20.20'),)])
+        self.assertEqual(log.columns.selected_rows, 2)
+
+    def test_remembered_searches_are_limited_in_number(self):
+        """Tests that searches writing out the same query again share one
+        remembered result, and that searches finding nothing still count
+        towards SEARCH_CACHE_SIZE"""
+        self.addCleanup(setattr, ufw, 'SEARCH_CACHE_SIZE',
+                        ufw.SEARCH_CACHE_SIZE)
+        ufw.SEARCH_CACHE_SIZE = 2
+        log = ufw.UFWLogFile(self.filename)
+        block, allow, limit = log.log_events
+
+        for _ in range(3):
+            self.assertEqual(log[(DPT == 22) & (EVENT == 'LIMIT BLOCK')],
+                             [limit])
+        self.assertEqual(len(log.columns.selections), 1)
+
+        for port in range(1, 20):
+            self.assertEqual(log[(DPT == port) & (EVENT == 'BLOCK')], [])
+        self.assertEqual(len(log.columns.selections), 2)
+
+    def test_search_sees_entries_changed_in_place(self):
+        """Tests that searching after sorting the entries, replacing one or
+        editing one and clearing the columns finds the entries as they are
+        now, not as they were when first searched"""
+        log = ufw.UFWLogFile(self.filename)
+        block, allow, limit = log.log_events
+        search_fns = [DPT == 22]
+
+        self.assertEqual(log.search(search_fns), [allow, limit])
+        log.log_events.sort(key=lambda entry: entry.DPT)
+        log.clear_columns()
+        self.assertEqual(log.search(search_fns), [allow, limit])
+        self.assertEqual(log.search_eq('SRC', '20.20.20.20'), [limit, block])
+
+        log.log_events[0] = block
+        log.clear_columns()
+        self.assertEqual(log.search(search_fns), [limit])
+
+        block.SRC = '10.0.0.5'
+        log.clear_columns()
+        self.assertEqual(log.search_eq('SRC', '10.0.0.5'), [block, block])
+
+    def test_search_between_sorted_and_unsorted_fields(self):
+        """Tests that ranges of fields in ascending order, which are found
+        by bisecting, match the ranges found by filtering"""
+        log = ufw.UFWLogFile(self.filename)
+        block, allow, limit = log.log_events
+        log.log_events.sort(key=lambda entry: entry.event_datetime)
+
+        self.assertTrue(log.columns.is_sorted('event_datetime'))
+        self.assertFalse(log.columns.is_sorted('SPT'))
+        self.assertFalse(log.columns.is_sorted('OUT'))
+        self.assertEqual(log.search_between('event_datetime',
+                                            allow.event_datetime,
+                                            block.event_datetime),
+                         [allow, block])
+        self.assertEqual(log.search_between('event_datetime',
+                                            limit.event_datetime,
+                                            allow.event_datetime), [])
+        self.assertEqual(log.search_between('SPT', 43254, 51000),
+                         [allow, block])
+
+    def test_prefilter_skips_lines_before_parsing(self):
+        """Tests that only lines containing the prefilter text, or that the
+        prefilter function returns True for, are parsed"""
+        by_text = ufw.UFWLogFile.from_file_filtered(self.filename,
+                                                    'SRC=20.20.20.20 ')
+        by_function = ufw.UFWLogFile.from_file_filtered(
+            self.filename, lambda line: 'DPT=22 ' in line)
+
+        self.assertEqual([entry.event for entry in by_text],
+                         ['BLOCK', 'LIMIT BLOCK'])
+        self.assertEqual([entry.event for entry in by_function],
+                         ['ALLOW', 'LIMIT BLOCK'])
+
+    def test_prefilter_accepts_bytes_and_rejects_other_types(self):
+        """Tests that a bytes prefilter works like the same text, and that
+        anything besides text, bytes or a function is a TypeError"""
+        by_bytes = ufw.UFWLogFile.from_file_filtered(self.filename,
+                                                     b'SRC=20.20.20.20 ')
+
+        self.assertEqual([entry.event for entry in by_bytes],
+                         ['BLOCK', 'LIMIT BLOCK'])
+        with self.assertRaisesRegex(TypeError, 'prefilter'):
+            ufw.UFWLogFile.from_file_filtered(self.filename, 22)
+
+    def test_search_between_skips_entries_without_field(self):
+        """Tests that entries without the field being searched, like pings
+        that have no ports, are left out of a range instead of failing to
+        compare"""
+        log = ufw.UFWLogFile(self.filename)
+        block, allow, limit = log.log_events
+        log.log_events.append(ufw.UFWLogEntry.from_str(PING_LINE))
+
+        self.assertEqual(log.search_between('DPT', 1, 1024), [allow, limit])
+        self.assertEqual(log.search_between('DPT', 1, 1024), [allow, limit])
+        self.assertEqual(len(log.columns.selections), 1)
+
+    def test_load_all_parses_every_file(self):
+        """Tests that load_all returns a parsed log for every path, in the
+        order the paths were given, including gzip compressed ones"""
+        compressed = self.filename + '.gz'
+        with open(self.filename, 'rb') as reader, \
+                gzip.open(compressed, 'wb') as writer:
+            writer.write(reader.read())
+        self.addCleanup(os.remove, compressed)
+
+        logs = ufw.load_all([compressed, self.filename], max_workers=2)
+
+        self.assertEqual([log.filename for log in logs],
+                         [compressed, self.filename])
+        for log in logs:
+            self.assertEqual([entry.event for entry in log],
+                             ['BLOCK', 'ALLOW', 'LIMIT BLOCK'])
+
+
+class FilenamesByPatternTests(TestCase):
+    def test_finds_ufw_logs_in_directory(self):
+        """Tests that only files starting with "ufw" are returned, joined to
+        the directory whether or not it ends with a separator"""
+        with tempfile.TemporaryDirectory() as path:
+            for name in ('ufw.log', 'ufw.log.1', 'ufw.log.2.gz', 'syslog',
+                         'kern.ufw.log'):
+                open(os.path.join(path, name), 'w').close()
+            expected = sorted(os.path.join(path, name) for name in
+                              ('ufw.log', 'ufw.log.1', 'ufw.log.2.gz'))
+
+            self.assertEqual(sorted(ufw.filenames_by_pattern(path)), expected)
+            self.assertEqual(
+                sorted(ufw.filenames_by_pattern(path + os.sep)), expected)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,8 @@
 from ufw.ufw import UFWLogFile, UFWLogEntry
 # function for getting log paths easier
 from ufw.ufw import filenames_by_pattern
+# function for parsing several log files in parallel
+from ufw.ufw import load_all
 # search functions
 from ufw.filter_tools import EVENT_DATETIME, HOSTNAME, UPTIME, EVENT, IN, OUT, \
     MAC, SRC, DST, LEN, TC, TOS, PERC, TTL, ID, PROTO, SPT, DPT, WINDOW, RES, \
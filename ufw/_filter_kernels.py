@@ -0,0 +1,54 @@
+"""
+Column kernels used by FilterFunction.apply
+
+A column store maps attribute names to equally sized sequences of values
+and maps None to the rows themselves. A selection is a sorted list of row
+indices, or None for every row. Each kernel takes a selection and returns
+a new one. The loops run through map/compress/filterfalse, so no Python
+function is called per row unless the predicate is a Python function
+"""
+from itertools import compress, filterfalse, repeat
+
+
+def rows(columns, indices):
+    # every row when no selection has been made yet
+    return range(len(columns[None])) if indices is None else indices
+
+
+def values(columns, attr, indices):
+    # the values of one column for the selected rows only
+    column = columns[attr]
+    return column if indices is None else map(column.__getitem__, indices)
+
+
+def select(predicate, columns, attr, indices) -> list:
+    """Returns the indices of the rows where ``predicate(row.attr)`` is
+    truthy"""
+    return list(compress(rows(columns, indices),
+                         map(predicate, values(columns, attr, indices))))
+
+
+def compare(op, columns, attr, value, indices) -> list:
+    """Returns the indices of the rows where ``op(row.attr, value)`` is
+    truthy"""
+    return list(compress(rows(columns, indices),
+                         map(op, values(columns, attr, indices),
+                             repeat(value))))
+
+
+def complement(columns, indices, kept) -> list:
+    """Returns the selected indices that are not in ``kept``"""
+    return list(filterfalse(set(kept).__contains__, rows(columns, indices)))
+
+
+def union(kept, added) -> list:
+    """Merges two selections that have no indices in common"""
+    # both are already sorted, which sort() handles in linear time
+    merged = kept + added
+    merged.sort()
+    return merged
+
+
+def difference(kept, removed) -> list:
+    """Returns the indices of ``kept`` that are not in ``removed``"""
+    return list(filterfalse(set(removed).__contains__, kept))
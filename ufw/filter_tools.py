@@ -7,11 +7,62 @@ COMMITTER:  Mason Logan <ufw@masonlogan.com>
 Provides a set of constants that can be used as a way of filtering a
 UFWLogFile object
 """
+import operator
 import re
+import sys
+import unicodedata
 from collections.abc import Callable
+from functools import lru_cache, partial, wraps
+from keyword import iskeyword
 
+from ufw import _filter_kernels as kernels
 
-class FilterFunction(Callable):
+
+# Rough relative cost of evaluating a filter on one event. "&" and "|" run
+# the cheaper side first so, for example, a port comparison can reject most
+# events before a regex search ever sees them
+COMPARISON_COST = 1
+REGEX_COST = 50
+
+
+# Column operator for each comparison "event <symbol> value" a LogFilter can
+# build, and the same comparison written the other way around as
+# "op(value, event)", which lets a filter on the events themselves be a
+# partial of a C function
+_COLUMN_OPERATORS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '>': operator.gt,
+    '<': operator.lt,
+    '>=': operator.ge,
+    '<=': operator.le,
+}
+_REFLECTED_OPERATORS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '>': operator.lt,
+    '<': operator.gt,
+    '>=': operator.le,
+    '<=': operator.ge,
+    'in': operator.contains,
+}
+
+
+@lru_cache(maxsize=256)
+def _comparison_factory(operand: str, symbol: str) -> Callable:
+    """Compiles a function that takes a getter and a value and returns
+    ``lambda event: <operand> <symbol> value``. Writing the comparison out
+    in source keeps it down to a single Python call per event, and when the
+    operand is "event.<attr>" the interpreter does a plain attribute load
+    instead of calling a getter. Only called with identifier attributes
+    and the fixed set of symbols used by LogFilter"""
+    namespace = {}
+    exec(f'def factory(getter, value):\n'
+         f'    return lambda event: {operand} {symbol} value\n', namespace)
+    return namespace['factory']
+
+
+class FilterFunction:
     """
     Wrapper for functions returned by LogFilter that allows for logical
     combination of functions
@@ -29,64 +80,319 @@ class FilterFunction(Callable):
     # which would provide a list of all attempts made by someone at IP address
     # 20.20.20.20 that were rejected
     #
+    # Every FilterFunction can also be applied to a whole column store at
+    # once with apply(). Functions made by LogFilter carry a vec_func that
+    # compares an entire column in C (map/compress) rather than calling a
+    # Python function per event; anything else falls back to calling func
+    # on each row. Selections are passed from one function to the next, so
+    # the right-hand side of "&" only sees the rows the left-hand side kept,
+    # exactly like the short-circuiting row-at-a-time version.
+    #
+    # A single LogFilter comparison also records itself as a leaf
+    # (attr, symbol, value), meaning "event.<attr> <symbol> value". That
+    # lets "(DPT == 22) | (DPT == 80) | (DPT == 443)" be merged into one
+    # "DPT in {22, 80, 443}" hash lookup instead of a chain of compares.
+    #
+    # Functions built only out of LogFilter comparisons against hashable
+    # values are pure: what they select depends on nothing but the events,
+    # so UFWLogFile.search can reuse their results. A function wrapping any
+    # other callable may depend on state that changes between searches.
+    # Pure functions carry a key describing how they were built, e.g.
+    # ('&', ('DPT', '==', 22), ('event', '==', 'BLOCK')), so writing the same
+    # query out again gives an equal key even though it's a new function.
+
+    __slots__ = ('func', 'vec_func', 'cost', 'leaf', 'key')
 
-    def __init__(self, func):
+    def __init__(self, func, vec_func=None, cost=COMPARISON_COST, leaf=None,
+                 key=None):
         self.func = func
+        self.vec_func = vec_func
+        self.cost = cost
+        self.leaf = leaf
+        self.key = key
+
+    @property
+    def pure(self) -> bool:
+        return self.key is not None
 
     def __call__(self, value):
         return self.func(value)
 
+    def apply(self, columns, indices=None) -> list:
+        """Returns the sorted indices of the rows that satisfy this function.
+        ``columns`` maps attribute names to equally sized sequences of values
+        and maps None to the rows themselves. If ``indices`` is provided,
+        only those rows are checked"""
+        if self.vec_func is not None:
+            return self.vec_func(columns, indices)
+        return kernels.select(self.func, columns, None, indices)
+
+    # The combined functions close over both callables as locals so that
+    # calling them doesn't have to look up self.func on every event. When
+    # the other side is a FilterFunction its func is used directly, which
+    # skips a pass through FilterFunction.__call__ per event. When both
+    # sides are pure the cheaper of the two is evaluated first. Anything
+    # else is evaluated in the order it was written, since the left side
+    # may be there to keep the right side from seeing events it can't handle
+
     def __and__(self, func: Callable):
-        return FilterFunction(lambda value: self.func(value) and func(value))
+        merged = self.__merge(func, '!=', 'not in')
+        if merged is not None:
+            return merged
+        first, second = self.__by_cost(func)
+        f, g = first.func, second.func
+        return FilterFunction(
+            lambda value: f(value) and g(value),
+            lambda columns, indices:
+                second.apply(columns, first.apply(columns, indices)),
+            first.cost + second.cost, key=_combined_key('&', first, second))
 
     def __or__(self, func: Callable):
-        return FilterFunction(lambda value: self.func(value) or func(value))
+        merged = self.__merge(func, '==', 'in')
+        if merged is not None:
+            return merged
+        first, second = self.__by_cost(func)
+        f, g = first.func, second.func
+        return FilterFunction(lambda value: f(value) or g(value),
+                              first.__union(second),
+                              first.cost + second.cost,
+                              key=_combined_key('|', first, second))
 
     def __add__(self, func: Callable):
         """Logically adds the results of this function with the provided one"""
-        return FilterFunction(lambda value: self.func(value) or func(value))
+        return self | func
 
     def __sub__(self, func: Callable):
         """Removes elements from this function's return set that are in the
         other function's return set"""
-        return FilterFunction(lambda value: self.func(value) and not func(value))
+        other = _as_filter_function(func)
+        f, g = self.func, other.func
+
+        def vec_func(columns, indices):
+            kept = self.apply(columns, indices)
+            return kernels.difference(kept, other.apply(columns, kept))
+
+        return FilterFunction(lambda value: f(value) and not g(value),
+                              vec_func, self.cost + other.cost,
+                              key=_combined_key('-', self, other))
+
+    def __merge(self, func: Callable, symbol: str, set_symbol: str):
+        # combines "symbol" comparisons on the same attribute (or sets of
+        # them that were already merged) into one set_symbol membership test
+        if not isinstance(func, FilterFunction) \
+                or self.leaf is None or func.leaf is None:
+            return None
+        attr = self.leaf[0]
+        values = []
+        for leaf_attr, leaf_symbol, value in (self.leaf, func.leaf):
+            if leaf_attr != attr:
+                return None
+            if leaf_symbol == symbol:
+                values.append(value)
+            elif leaf_symbol == set_symbol:
+                values.extend(value)
+            else:
+                return None
+        try:
+            values = frozenset(values)
+        except TypeError:
+            return None
+        return LogFilter(attr)._membership(set_symbol, values)
+
+    def __by_cost(self, func: Callable):
+        other = _as_filter_function(func)
+        if self.pure and other.pure and other.cost < self.cost:
+            return other, self
+        return self, other
+
+    def __union(self, other):
+        def vec_func(columns, indices):
+            # the other function only needs to check what this one rejected
+            kept = self.apply(columns, indices)
+            rest = kernels.complement(columns, indices, kept)
+            return kernels.union(kept, other.apply(columns, rest))
+        return vec_func
+
+
+def _combined_key(symbol: str, first: FilterFunction,
+                  second: FilterFunction) -> tuple:
+    # only pure when both sides are
+    if first.key is None or second.key is None:
+        return None
+    return symbol, first.key, second.key
+
+
+def _as_filter_function(func: Callable) -> FilterFunction:
+    return func if isinstance(func, FilterFunction) else FilterFunction(func)
+
+
+def _hashable(value) -> bool:
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
+
+def _memoized(comparison: Callable) -> Callable:
+    """Caches the FilterFunction a LogFilter comparison returns, so asking
+    for the same comparison again (e.g. DPT == 25565 on every query) returns
+    the same object instead of building a new one. Values that can't be
+    hashed are never cached"""
+    # LogFilter overrides __eq__, so it can't be part of the key itself
+    @lru_cache(maxsize=1024, typed=True)
+    def cached(attr, value):
+        return comparison(LogFilter(attr), value)
+
+    @wraps(comparison)
+    def wrapper(self, value):
+        try:
+            return cached(self.attr, value)
+        except TypeError:
+            return comparison(self, value)
+    return wrapper
 
 
 class LogFilter:
-    def __init__(self, attr):
-        self.attr = attr
+    """
+    Builds FilterFunctions that compare one attribute of an event against a
+    value, e.g. ``DPT == 22`` keeps the events where ``event.DPT == 22``
+    """
 
-    def __extract(self, event):
+    # The ordering operators read as "the value being filtered for is ...":
+    # "TTL < 64" keeps events with a TTL *greater* than 64, and so on. Each
+    # one is built from the comparison as it is applied to the event's
+    # value, not the operator that was written, so the leaf recorded for
+    # "TTL < 64" is ('TTL', '>', 64) and the column path calls operator.gt
+    # directly without having to swap anything:
+    #   filter <  value  ->  event.attr >  value
+    #   filter >  value  ->  event.attr <  value
+    #   filter <= value  ->  event.attr >= value
+    #   filter >= value  ->  event.attr <= value
+
+    __slots__ = ('attr', '_getter')
+
+    def __init__(self, attr):
+        # interned so attribute lookups on events can match the name by
+        # identity instead of comparing strings
+        object.__setattr__(self, 'attr', sys.intern(attr)
+                           if isinstance(attr, str) else attr)
+        # the getter is resolved once here so the returned functions don't
+        # have to look up the attribute by name through Python on every event.
         # if self.attr is None, we evaluate objects exactly as they are
-        return event if self.attr is None else getattr(event, self.attr)
+        object.__setattr__(self, '_getter', operator.attrgetter(attr)
+                           if attr is not None else (lambda event: event))
 
+    @_memoized
     def __eq__(self, value) -> FilterFunction:
-        return FilterFunction(lambda event: self.__extract(event) == value)
+        return self.__compare('==', value)
 
+    @_memoized
     def __ne__(self, value) -> FilterFunction:
-        return FilterFunction(lambda event: self.__extract(event) != value)
+        return self.__compare('!=', value)
 
+    @_memoized
     def __lt__(self, value) -> FilterFunction:
-        return FilterFunction(lambda event: self.__extract(event) > value)
+        return self.__compare('>', value)
 
+    @_memoized
     def __gt__(self, value) -> FilterFunction:
-        return FilterFunction(lambda event: self.__extract(event) < value)
+        return self.__compare('<', value)
 
+    @_memoized
     def __le__(self, value) -> FilterFunction:
-        return FilterFunction(lambda event: self.__extract(event) >= value)
+        return self.__compare('>=', value)
 
+    @_memoized
     def __ge__(self, value) -> FilterFunction:
-        return FilterFunction(lambda event: self.__extract(event) <= value)
+        return self.__compare('<=', value)
 
+    @_memoized
     def __mod__(self, value) -> FilterFunction:
-        return FilterFunction(lambda event:
-                              any(re.findall(value, self.__extract(event))))
+        g = self._getter
+        attr = self.attr
+        # compiled once here instead of on every event; search stops at the
+        # first match where findall would have collected all of them
+        search = re.compile(value).search
+        return FilterFunction(
+            lambda event: search(g(event)) is not None,
+            # match objects are always truthy, so they work as the selector
+            lambda columns, indices:
+                kernels.select(search, columns, attr, indices),
+            REGEX_COST, key=(attr, '%', value))
+
+    def _membership(self, symbol: str, values: frozenset) -> FilterFunction:
+        """Builds "event.<attr> in values" (or "not in"), which is what
+        FilterFunction merges chains of "|"/"==" and "&"/"!=" into"""
+        attr = self.attr
+        getter = self._getter
+        contains = values.__contains__
+        # values that can't be hashed are compared with each member instead,
+        # the way the chain of comparisons merged into this one would have
+        if symbol == 'in':
+            def each(value):
+                return any(value == member for member in values)
+        else:
+            def each(value):
+                return all(value != member for member in values)
+
+        hashed = self.__row_function(symbol, values)
+
+        def row_function(event):
+            try:
+                return hashed(event)
+            except TypeError:
+                return each(getter(event))
+
+        def vec_func(columns, indices):
+            try:
+                kept = kernels.select(contains, columns, attr, indices)
+            except TypeError:
+                return kernels.select(each, columns, attr, indices)
+            if symbol == 'in':
+                return kept
+            return kernels.complement(columns, indices, kept)
+
+        return FilterFunction(row_function, vec_func,
+                              leaf=(attr, symbol, values),
+                              key=(attr, symbol, values))
+
+    def __compare(self, symbol, value):
+        attr = self.attr
+        op = _COLUMN_OPERATORS[symbol]
+        return FilterFunction(
+            self.__row_function(symbol, value),
+            lambda columns, indices:
+                kernels.compare(op, columns, attr, value, indices),
+            # a value that can't be hashed, like a list, could be changed
+            # by whoever passed it in after the comparison is made
+            leaf=(attr, symbol, value),
+            key=(attr, symbol, value) if _hashable(value) else None)
+
+    def __row_function(self, symbol, value):
+        attr = self.attr
+        if attr is None:
+            op = _REFLECTED_OPERATORS.get(symbol)
+            if op is not None:
+                # no attribute to load, so the comparison can be done
+                # without going through a Python function at all
+                return partial(op, value)
+            operand = 'event'
+        elif isinstance(attr, str) and attr.isidentifier() \
+                and not iskeyword(attr) \
+                and unicodedata.normalize('NFKC', attr) == attr:
+            # the compiler NFKC normalizes identifiers, e.g. the "fi"
+            # ligature U+FB01 becomes "fi", so any name that would change
+            # that way goes through the getter instead
+            operand = f'event.{attr}'
+        else:
+            operand = 'getter(event)'
+        return _comparison_factory(operand, symbol)(self._getter, value)
 
     def __setattr__(self, name, value):
-        # object should not be able to change after created
-        if getattr(self, 'attr', False):
-            raise AttributeError(f'{self.attr.upper()} is immutable!')
-        self.__dict__[name] = value
+        # object should not be able to change after created; __init__ sets
+        # its slots with object.__setattr__ so nothing needs to get past this
+        raise AttributeError(f'{str(self.attr).upper()} is immutable!')
 
 
 # PRESET FUNCTIONS FOR CONVENIENCE
@@ -1,12 +1,55 @@
+import gzip
 import json
 import os
 import re
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
 from collections.abc import Iterable, Callable
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from itertools import islice, repeat
+from operator import attrgetter, le
+
+from ufw.filter_tools import FilterFunction, LogFilter
 
 UBUNTU_LOG_PATH = '/var/log/'
 UBUNTU_DEFAULT_PATH = '/var/log/ufw.log'
-UFW_LOG_PATTERN = '^ufw.*'
+# only the start of the name has to match, so there's no need for a trailing
+# ".*" to scan the rest of it
+UFW_LOG_PATTERN = '^ufw'
+# how many earlier searches UFWLogFile.search keeps the results of, and how
+# many rows it keeps across all of them; each row takes 8 bytes
+SEARCH_CACHE_SIZE = 128
+SEARCH_CACHE_ROWS = 1 << 20
+# fields search_eq keeps an index of; each has few distinct values compared
+# to the number of entries, where an index of something like ID or uptime
+# would need an entry of its own for nearly every row
+INDEXED_FIELDS = frozenset(('SRC', 'DST', 'PROTO', 'event'))
+
+_MONTHS = {'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
+           'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12}
+
+# One line of a ufw log, e.g.
+#   Sep 21 10:15:01 myhost kernel: [ 1234.567890] [UFW BLOCK] IN=eth0 ...
+# syslog pads single digit days and ufw pads the uptime with spaces, which
+# the " +" and "\s*" absorb. ICMP errors go on to quote the packet that
+# caused them in brackets, e.g. "[SRC=10.0.0.1 DST=... ]", which the fields
+# stop short of so its keys can't replace the entry's own
+_LINE_RE = re.compile(
+    rf'(?P<month>{"|".join(_MONTHS)}) +(?P<day>\d{{1,2}}) '
+    r'(?P<hour>\d\d):(?P<minute>\d\d):(?P<second>\d\d) '
+    r'(?P<hostname>\S+ \S+) \[\s*(?P<uptime>[\d.]+)\] '
+    r'\[UFW (?P<event>[^\]]+)\] (?P<fields>[^\[\n]*)'
+)
+# KEY=value pairs in the rest of the line; keys with no value are skipped
+_FIELD_RE = re.compile(r'(\w+)=(\S+)')
+# fields that are always written as decimal numbers; TOS and PREC are hex
+_INT_FIELDS = frozenset(('LEN', 'TTL', 'ID', 'SPT', 'DPT', 'WINDOW'))
+# text fields that repeat from line to line, e.g. the host's own address
+# and MAC, which entries share a single copy of
+_INTERNED_FIELDS = frozenset(('IN', 'OUT', 'MAC', 'SRC', 'DST', 'TOS',
+                              'PROTO', 'RES'))
 
 
 class UFWLogFileJSONEncoder(json.JSONEncoder):
@@ -15,33 +58,14 @@ class UFWLogFileJSONEncoder(json.JSONEncoder):
     def get_UFWLogEntry_json(self, ufw_entry) -> dict:
         """Extracts values from a UFWLogEntry object into a dict,
         excluding any key-value pairs where the value is None"""
-        data = {
-            'event_datetime': ufw_entry.event_datetime.strftime(
-                '%Y-%m-%d %H:%M:%S.%f'),
-            'hostname': ufw_entry.hostname,
-            'uptime': ufw_entry.uptime,
-            'event': ufw_entry.event,
-            'IN': ufw_entry.IN,
-            'OUT': ufw_entry.OUT,
-            'MAC': ufw_entry.MAC,
-            'SRC': ufw_entry.SRC,
-            'DST': ufw_entry.DST,
-            'LEN': ufw_entry.LEN,
-            'TC': ufw_entry.TC,
-            'TOS': ufw_entry.TOS,
-            'PERC': ufw_entry.PERC,
-            'TTL': ufw_entry.TTL,
-            'ID': ufw_entry.ID,
-            'PROTO': ufw_entry.PROTO,
-            'SPT': ufw_entry.SPT,
-            'DPT': ufw_entry.DPT,
-            'WINDOW': ufw_entry.WINDOW,
-            'RES': ufw_entry.RES,
-            'SYN_URGP': ufw_entry.SYN_URGP,
-            'ACK': ufw_entry.ACK,
-            'PSH': ufw_entry.PSH,
-        }
-        return {key: value for key, value in data.items() if value is not None}
+        # same text as strftime('%Y-%m-%d %H:%M:%S.%f') in half the time
+        data = {'event_datetime': ufw_entry.event_datetime.isoformat(
+            sep=' ', timespec='microseconds')}
+        for name in _JSON_FIELDS:
+            value = getattr(ufw_entry, name)
+            if value is not None:
+                data[name] = value
+        return data
 
     def default(self, ufw_file_obj):
         return [self.get_UFWLogEntry_json(entry)
@@ -51,6 +75,12 @@ class UFWLogFileJSONEncoder(json.JSONEncoder):
 class UFWLogEntry:
     """Class for working with a single entry in a ufw log"""
 
+    # a log can hold millions of entries, so they don't get a __dict__
+    __slots__ = ('event_datetime', 'hostname', 'uptime', 'event', 'IN', 'OUT',
+                 'MAC', 'SRC', 'DST', 'LEN', 'TC', 'TOS', 'PERC', 'TTL', 'ID',
+                 'PROTO', 'SPT', 'DPT', 'WINDOW', 'RES', 'SYN_URGP', 'ACK',
+                 'PSH')
+
     def __init__(self, event_datetime: datetime, hostname: str, uptime: float,
                  event, IN=None, OUT=None, MAC=None, SRC=None, DST=None,
                  TC=None, LEN=None, TOS=None, PERC=None, TTL=None, ID=None,
@@ -72,36 +102,133 @@ class UFWLogEntry:
         self.TTL = TTL
         self.ID = ID
         self.PROTO = PROTO
-        self.SPT = SPT if not isinstance(SPT, str) else int(SPT)
-        self.DPT = DPT if not isinstance(DPT, str) else int(DPT)
+        self.SPT = SPT
+        self.DPT = DPT
         self.WINDOW = WINDOW
         self.RES = RES
         self.SYN_URGP = SYN_URGP
         self.ACK = ACK
         self.PSH = PSH
 
+    def __reduce__(self):
+        # rebuilding entries from __init__'s arguments pickles faster and
+        # smaller than the default slot by slot state, which matters when
+        # load_all sends whole logs back from its worker processes
+        return type(self), _INIT_ARGS(self)
+
     @staticmethod
-    def from_str(data):
-        # UFW pads the uptime timestamp with whitespace, so we have to
-        # check for that and remove it or the parsing fails
-        if '[ ' in data:
-            data = '['.join(i.lstrip() for i in data.split('['))
-        data = data.split(' ')[:-1]
-        event_datetime = datetime.strptime(
-            ' '.join(data[0:3]), '%b %d %H:%M:%S'
-        )
-        hostname = ' '.join(data[3:5])
-        if not data[5][1:-1]:
-            print('pause!')
-        uptime = float(data[5][1:-1])
-        event = data[7][:-1]
-        kwargs_raw = (dat.split('=') for dat in data[8:] if '=' in dat)
-        kwargs = {key: value for key, value in kwargs_raw if key and value}
-        kwargs['ACK'] = 'ACK' in data[8:]
-        kwargs['PSH'] = 'PSH' in data[8:]
-
-        return UFWLogEntry(event_datetime=event_datetime, hostname=hostname,
-                           uptime=uptime, event=event, **kwargs)
+    def from_str(data, year: int = 1900):
+        # syslog doesn't write the year, so it has to be provided
+        match = _LINE_RE.match(data)
+        if match is None:
+            raise ValueError(f'Not a ufw log entry: {data!r}')
+        month, day, hour, minute, second, hostname, uptime, event, fields = \
+            match.groups()
+        event_datetime = datetime(year, _MONTHS[month], int(day), int(hour),
+                                  int(minute), int(second))
+        kwargs = dict(_FIELD_RE.findall(fields))
+        # converted here once so comparing them later doesn't need int()
+        for key in _INT_FIELDS.intersection(kwargs):
+            kwargs[key] = int(kwargs[key])
+        for key in _INTERNED_FIELDS.intersection(kwargs):
+            kwargs[key] = sys.intern(kwargs[key])
+        # flags are bare words between the KEY=value pairs; padding the
+        # fields lets a substring search find them without splitting
+        fields = f' {fields} '
+        kwargs['ACK'] = ' ACK ' in fields
+        kwargs['PSH'] = ' PSH ' in fields
+
+        return UFWLogEntry(event_datetime=event_datetime,
+                           hostname=sys.intern(hostname),
+                           uptime=float(uptime), event=sys.intern(event),
+                           **kwargs)
+
+
+# the attributes of an entry in the order __init__ takes them
+_INIT_ARGS = attrgetter('event_datetime', 'hostname', 'uptime', 'event', 'IN',
+                        'OUT', 'MAC', 'SRC', 'DST', 'TC', 'LEN', 'TOS', 'PERC',
+                        'TTL', 'ID', 'PROTO', 'SPT', 'DPT', 'WINDOW', 'RES',
+                        'SYN_URGP', 'ACK', 'PSH')
+# every attribute of an entry besides event_datetime, in the order they are
+# written to JSON
+_JSON_FIELDS = UFWLogEntry.__slots__[1:]
+
+
+class UFWLogColumns(dict):
+    """Column-oriented view of a list of UFWLogEntry objects. Maps each
+    attribute name to a list holding that attribute for every entry, and
+    None to the entries themselves. Columns are only extracted the first
+    time they are asked for. Anything worked out from the columns, like
+    the results of searches, is kept here too so it's thrown away with
+    them"""
+
+    def __init__(self, log_events: list):
+        super().__init__()
+        self[None] = log_events
+        self.size = len(log_events)
+        # selections made by earlier searches, keyed by the keys of the
+        # functions used
+        self.selections = {}
+        self.selected_rows = 0
+        self.__sorted = {}
+        self.__indexes = {}
+
+    def __missing__(self, attr):
+        column = self[attr] = list(map(attrgetter(attr), self[None]))
+        return column
+
+    def remember(self, key: tuple, indices: list):
+        """Keeps the rows a search selected, dropping the least recently
+        used searches to hold no more than SEARCH_CACHE_SIZE searches and
+        SEARCH_CACHE_ROWS rows"""
+        if len(indices) > SEARCH_CACHE_ROWS:
+            return
+        selections = self.selections
+        while len(selections) >= SEARCH_CACHE_SIZE \
+                or self.selected_rows + len(indices) > SEARCH_CACHE_ROWS:
+            self.selected_rows -= len(selections.pop(next(iter(selections))))
+        # stored as machine integers instead of a list of int objects
+        selections[key] = array('L', indices)
+        self.selected_rows += len(indices)
+
+    def index(self, attr) -> dict:
+        """Returns a dict mapping each value in the column for ``attr`` to
+        the index of the row that has it, or an array of the indices if
+        more than one row does"""
+        index = self.__indexes.get(attr)
+        if index is None:
+            index = self.__indexes[attr] = {}
+            # an array of row numbers is smaller than a list of int objects
+            # from two rows up, but a value only one row has is cheapest
+            # kept as the bare row number
+            for row, value in enumerate(self[attr]):
+                rows = index.get(value)
+                if rows is None:
+                    index[value] = row
+                elif type(rows) is int:
+                    index[value] = array('L', (rows, row))
+                else:
+                    rows.append(row)
+        return index
+
+    def lookup(self, attr, value):
+        """Returns the indices of the rows where ``attr`` is ``value``,
+        using the index of ``attr``"""
+        rows = self.index(attr).get(value, ())
+        return (rows,) if type(rows) is int else rows
+
+    def is_sorted(self, attr) -> bool:
+        """Returns whether the column for ``attr`` is in ascending order,
+        in which case ranges of it can be found with bisect"""
+        if attr not in self.__sorted:
+            column = self[attr]
+            try:
+                in_order = all(map(le, column, islice(column, 1, None)))
+            except TypeError:
+                # values that can't be ordered, like None next to an int
+                in_order = False
+            self.__sorted[attr] = in_order
+        return self.__sorted[attr]
 
 
 class UFWLogFile:
@@ -109,41 +236,201 @@ class UFWLogFile:
     an iterable, context manager, and ability to mix indexes, slices, and
     functions to get log entries"""
 
-    def __init__(self, filename=UBUNTU_DEFAULT_PATH):
+    def __init__(self, filename=UBUNTU_DEFAULT_PATH, prefilter=None):
         self.log_events = list()
+        self._columns = None
         self.filename = filename
-        with open(filename, 'r') as reader:
-            for line in reader.readlines():
-                self.log_events.append(UFWLogEntry.from_str(line))
-        for event in self.log_events:
-            event.event_datetime = event.event_datetime.replace(
-                datetime.fromtimestamp(os.path.getctime(filename)).year
-            )
+        # logrotate compresses the older logs, e.g. /var/log/ufw.log.2.gz
+        opener = gzip.open if filename.endswith('.gz') else open
+        with opener(filename, 'rt') as reader:
+            # taken from the open file, so it can't be a different file than
+            # the one read if logrotate moves things around in between
+            ctime = os.fstat(reader.fileno()).st_ctime
+            year = datetime.fromtimestamp(ctime).year
+            lines = reader
+            if isinstance(prefilter, (bytes, bytearray)):
+                # lines are read as text, so it's decoded the same way once
+                prefilter = prefilter.decode(reader.encoding)
+            if isinstance(prefilter, str):
+                lines = (line for line in reader if prefilter in line)
+            elif isinstance(prefilter, Callable):
+                lines = filter(prefilter, reader)
+            elif prefilter is not None:
+                raise TypeError(f'prefilter must be a str, bytes or a '
+                                f'function, not {type(prefilter).__name__}')
+            # lines are read and parsed one at a time, so the whole file is
+            # never held in memory next to the entries made from it
+            self.log_events = list(map(UFWLogEntry.from_str, lines,
+                                       repeat(year)))
+
+    @classmethod
+    def from_file_filtered(cls, filename, prefilter):
+        """Reads only the lines of a log that contain ``prefilter``, which
+        can be str or bytes, or, if it's a function, that it returns True
+        for when given the raw line as a str. Lines that are skipped are
+        never parsed, which is much faster than reading everything and
+        searching when only a few entries are wanted.
+
+        The line is checked as a whole, so "10.0.0.5" keeps lines with it
+        as either address and "SRC=10.0.0.5" also keeps SRC=10.0.0.50;
+        end it with a space or search the result to narrow it down"""
+        return cls(filename, prefilter)
 
     def search(self, search_fns: Iterable = ()):
-        return [event for event in self.log_events
-                if all(fn(event) for fn in search_fns)]
+        """Returns the entries for which every function returns True.
+        The functions are applied to the column store one after the other,
+        each one only checking the rows the previous ones kept, and the
+        entries are only looked up once at the end.
+
+        Searching again for the same thing, even written out again as new
+        FilterFunctions, reuses the rows found the first time until the
+        columns are rebuilt. That's only done when every function is made
+        purely of LogFilter comparisons, since any other callable may give
+        different answers later on"""
+        search_fns = tuple(search_fns)
+        columns = self.columns
+        selections = columns.selections
+        key = None
+        if all(isinstance(fn, FilterFunction) and fn.pure
+               for fn in search_fns):
+            key = tuple(fn.key for fn in search_fns)
+        if key in selections:
+            # moved to the end so the least recently used search goes first
+            indices = selections[key] = selections.pop(key)
+        else:
+            indices = self.__select(columns, search_fns)
+            if key is not None and indices is not None:
+                columns.remember(key, indices)
+        if indices is None:
+            return list(self.log_events)
+        return list(map(self.log_events.__getitem__, indices))
+
+    @staticmethod
+    def __select(columns, search_fns):
+        # LogFilter comparisons are run cheapest first, the same way "&"
+        # orders them, but never moved past any other function. Those are
+        # run in the order given, so the functions before them can still
+        # keep them from seeing entries they can't handle
+        ordered, pure = [], []
+        for fn in search_fns:
+            if isinstance(fn, FilterFunction) and fn.pure:
+                pure.append(fn)
+                continue
+            pure.sort(key=attrgetter('cost'))
+            ordered += pure
+            ordered.append(fn if isinstance(fn, FilterFunction)
+                           else FilterFunction(fn))
+            pure = []
+        pure.sort(key=attrgetter('cost'))
+        ordered += pure
+        indices = None
+        for filter_func in ordered:
+            indices = filter_func.apply(columns, indices)
+        return indices
+
+    def search_eq(self, field: str, value):
+        """Returns the entries where the attribute ``field`` equals
+        ``value``"""
+        if field in INDEXED_FIELDS:
+            # the first search on an indexed field indexes it, after which
+            # any value can be looked up without going through the entries
+            try:
+                rows = self.columns.lookup(field, value)
+            except TypeError:
+                # values that can't be hashed can't be looked up, but can
+                # still be compared with each entry
+                pass
+            else:
+                return list(map(self.log_events.__getitem__, rows))
+        return self.search([LogFilter(field) == value])
+
+    def search_between(self, field: str, low, high):
+        """Returns the entries where the attribute ``field`` is between
+        ``low`` and ``high``, inclusive"""
+        columns = self.columns
+        if columns.is_sorted(field):
+            # e.g. event_datetime in a log that's in the order it was written
+            column = columns[field]
+            return self.log_events[bisect_left(column, low):
+                                   bisect_right(column, high)]
+        # LogFilter's ordering operators describe the value being filtered
+        # for, so "<= low" keeps entries whose field is at least low. Entries
+        # without the field, like pings with no ports, are left out first
+        # since None can't be ordered against the range
+        field_filter = LogFilter(field)
+        return self.search([(field_filter != None) &
+                            ((field_filter <= low) & (field_filter >= high))])
+
+    @property
+    def columns(self) -> UFWLogColumns:
+        # rebuilt whenever log_events is replaced or grows/shrinks, since the
+        # columns are only a copy of what was in the list when they were made.
+        # Changes that keep the length, like sorting, need clear_columns()
+        columns = self._columns
+        if columns is None or columns[None] is not self.log_events \
+                or columns.size != len(self.log_events):
+            columns = self._columns = UFWLogColumns(self.log_events)
+        return columns
+
+    def clear_columns(self):
+        """Throws away the columns made from the entries, along with the
+        indexes and remembered searches made from them. Call this after
+        changing log_events or an entry in place without changing how many
+        entries there are, e.g. sorting it or setting an entry's SRC"""
+        self._columns = None
 
     def serialize_to_file(self, filename):
+        # json.dump goes through the pure Python encoder so it can write in
+        # pieces, while dumps builds the whole string with the C one
+        text = json.dumps(self, cls=UFWLogFileJSONEncoder)
         with open(filename, 'w') as writer:
-            json.dump(self, writer, cls=UFWLogFileJSONEncoder)
+            writer.write(text)
 
     def __getitem__(self, indexes):
         out = list()
         indexes = indexes if isinstance(indexes, Iterable) else [indexes]
+        handlers = self.__index_handlers
         for index in indexes:
-            if isinstance(index, int):
-                out += [self.log_events[index]]
-            if isinstance(index, slice):
-                out += self.log_events[index]
-            if isinstance(index, Callable):
-                out += self.search([index])
-            if isinstance(index, list) and all([isinstance(item, Callable)
-                                                or isinstance(item, Callable)
-                                                for item in index]):
-                out += self.search(index)
+            handler = handlers.get(type(index)) or self.__handler_for(index)
+            if handler is not None:
+                handler(self, index, out)
         return out
 
+    def __by_position(self, index, out):
+        out.append(self.log_events[index])
+
+    def __by_slice(self, index, out):
+        out.extend(self.log_events[index])
+
+    def __by_function(self, index, out):
+        out.extend(self.search([index]))
+
+    def __by_functions(self, index, out):
+        if all(isinstance(item, Callable) for item in index):
+            out.extend(self.search(index))
+
+    # looked up by the exact type of each index before falling back to
+    # isinstance checks, since these cover nearly every index ever used
+    __index_handlers = {
+        int: __by_position,
+        slice: __by_slice,
+        FilterFunction: __by_function,
+        type(lambda: None): __by_function,
+        list: __by_functions,
+    }
+
+    @staticmethod
+    def __handler_for(index):
+        if isinstance(index, int):
+            return UFWLogFile.__by_position
+        if isinstance(index, slice):
+            return UFWLogFile.__by_slice
+        if isinstance(index, Callable):
+            return UFWLogFile.__by_function
+        if isinstance(index, list):
+            return UFWLogFile.__by_functions
+        return None
+
     def __iter__(self):
         # if we already have the log events, send them
         for event in self.log_events:
@@ -158,8 +445,19 @@ class UFWLogFile:
     def __exit__(self, *args, **kwargs):
         # erases the list to ensure memory is freed
         self.log_events = list()
+        self.clear_columns()
 
 
 def filenames_by_pattern(path: str = UBUNTU_LOG_PATH, pattern=UFW_LOG_PATTERN):
-    return [f'{path}{filepath}' for filepath in os.listdir(path)
-            if re.match(pattern, filepath)]
+    match = re.compile(pattern).match
+    return [os.path.join(path, filepath) for filepath in os.listdir(path)
+            if match(filepath)]
+
+
+def load_all(paths: Iterable = None, max_workers: int = None) -> list:
+    """Parses several log files at once, one per process, and returns a
+    UFWLogFile for each path in the same order. Defaults to every ufw log
+    found by filenames_by_pattern"""
+    paths = filenames_by_pattern() if paths is None else list(paths)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(UFWLogFile, paths))